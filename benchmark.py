@@ -0,0 +1,245 @@
+import pandas as pd
+import numpy as np
+from contextlib import contextmanager
+import argparse
+import datetime
+import json
+import openpyxl
+import os
+import pickle
+import platform
+import shutil
+import tempfile
+import time
+import excel_io
+import reference_data
+
+MCC_CODES = [str(x) for x in range(5000, 5200)]
+ACCOUNTS = ['61000', '62000', '63000', '63003', '64000', '65000']
+MERCHANTS = ['HOME DEPOT #1234', 'SHELL OIL 5555', 'AMAZON.COM*AB12', 'STANDARD VCF 4.4 100', 'STAPLES, INC.',
+             'AUTO PAYMENT DEDUCTION', "JOE'S DINER", 'DELTA AIR 0062']
+AGENTS = ['JOHN SMITH', 'JANE DOE', 'COMMERCIAL DEPARTMENT', np.nan, 'MARY ANN LEE']
+ESCROWS = [146, 219, 300, 310]
+
+def make_reference_data(dir, rng):
+    """accts, cos, employee and keywords pickles shaped like the ones under the databases directory."""
+    tables = {
+        'accts': {mcc: str(rng.choice(ACCOUNTS)) for mcc in MCC_CODES[:150]},
+        'cos': {},
+        'employee': {'{:04d}'.format(i): {'state': '{:02d}'.format(i % 5), 'branch': '{:03d}'.format(i % 7),
+                                          'dept': '{:02d}'.format(i % 3), 'ic_code': 'IC{}'.format(i % 4)}
+                     for i in range(400)},
+        'keywords': {'61500': ['HOME', 'DEPOT'], '62100': ['SHELL', 'EXXON', 'DEPOT'], '63000': ['STAPLES', 'AMAZON'],
+                     '64100': ['DELTA', 'UNITED', 'AIR']},
+    }
+    for name, table in tables.items():
+        with open(os.path.join(dir, name + '.pickle'), 'wb') as f:
+            pickle.dump(table, f)
+
+def make_td_statement(path, rows, rng):
+    """TD card export with the columns TD reads, including MCC/SIC Code and Originating Account Number."""
+    pd.DataFrame({
+        'Posting Date': pd.Timestamp('2021-03-15'),
+        'Account Number': '4111000000000000',
+        'Merchant Name': rng.choice(MERCHANTS, rows),
+        'MCC/SIC Code': rng.choice(MCC_CODES, rows),
+        'Originating Account Number': ['4111{:04d}'.format(x) for x in rng.integers(0, 450, rows)],
+        'Originating Account Name': [AGENTS[x] for x in rng.integers(0, len(AGENTS), rows)],
+        'Original Amount': rng.normal(50, 80, rows).round(2),
+    }).to_excel(path, index=False)
+
+def make_cash(dir, rows, rng):
+    """
+    cash.xlsx with EscrowBank, OrderCategory and SortField, a matching fee_master.xlsx and the branches, closing and
+    accounts pickles load_context reads.
+    """
+    files = ['{}-{}-{}'.format(rng.choice(['CS', '21']), i, rng.choice(['R', 'NJ1', str(rng.integers(10, 60))]))
+             for i in range(max(rows // 4, 1))]
+    cash = pd.DataFrame({
+        'File Number': rng.choice(files, rows),
+        'TitleCoNum': rng.choice(['10', '11', '12', '99'], rows),
+        'AcctCode': rng.choice(['40000', '40003', '40002', '66300', '66302', '61000', '43502', '96021', '96023'], rows),
+        'OrderCategory': rng.choice([1, 2, 3, 4, 5, 8, 25], rows),
+        'SortField': rng.choice([1, 2], rows, p=[.8, .2]),
+        'Invoice Line Total': rng.normal(200, 300, rows).round(2),
+        'PaymentDate': pd.Timestamp('2021-03-01'),
+        'EscrowBank': rng.choice(ESCROWS, rows),
+        'CloseAgent': rng.choice(['AB', 'CD', 'EF'], rows),
+    })
+    cash.to_excel(os.path.join(dir, 'cash.xlsx'), index=False)
+    fees = cash.groupby('File Number')['Invoice Line Total'].sum().round(2).reset_index()
+    fees.columns = ['File', 'Amount']
+    fees.to_excel(os.path.join(dir, 'fee_master.xlsx'), index=False)
+
+    ctx = {
+        'branches': {'10': '001', '11': '002', '12': '003'},
+        'closing': {oc: {'revenue': '4{:02d}00'.format(oc), 'count': '9{:02d}99'.format(oc)} for oc in [1, 2, 3, 4, 5, 8]},
+        'accounts': {escrow: {'bank': '1{}'.format(escrow), 'sheet': 'ESC{}'.format(escrow)} for escrow in ESCROWS},
+    }
+    for name, table in ctx.items():
+        with open(os.path.join(dir, name + '.pickle'), 'wb') as f:
+            pickle.dump(table, f)
+
+def make_financials(dir, rows, rng):
+    """financial_statement.xlsx with the Summary and Detail sheets, a GL detail.xlsx and expense_accounts.pickle."""
+    lines = {'Expense {}'.format(k): [str(60000 + k * 10 + j) for j in range(3)] for k in range(40)}
+    with open(os.path.join(dir, 'expense_accounts.pickle'), 'wb') as f:
+        pickle.dump(lines, f)
+
+    wb = openpyxl.Workbook()
+    summary = wb.active
+    summary.title = 'Inc Stmt - CMVPM - Summary'
+    summary.append(['Income Statement'] * 11)
+    summary.append([None] * 11)
+    summary.append([None] * 11)
+    for line in lines:
+        summary.append([None, None, None, line, 0, 0, 0, float(rng.integers(0, 6000)), 0, 0, 0])
+    detail = wb.create_sheet('Inc Stmt - CMVPM - Detail')
+    for _ in range(3):
+        detail.append(['Income Statement'] * 6)
+    detail.append([None, None, None, 'Start Date:', '01/01/2021'])
+    detail.append([None, None, None, 'End Date:', '03/31/2021'])
+    for _ in range(6):
+        detail.append(['-'] * 6)
+    wb.save(os.path.join(dir, 'financial_statement.xlsx'))
+
+    accts = [acct for accts in lines.values() for acct in accts] + ['70000', '70001']
+    dates = pd.date_range('2020-10-01', '2021-03-31')
+    ledger = pd.DataFrame({
+        'Posting Date': dates[rng.integers(0, len(dates), rows)].strftime('%m/%d/%Y'),
+        'Acct #': rng.choice(accts, rows).astype(int),
+        'Debit Amount': np.where(rng.random(rows) < .1, 0, rng.exponential(300, rows).round(2)),
+        'Vendor Name': rng.choice(['ACME CORP', 'WIDGETS LLC', None], rows),
+        'G/L Description': rng.choice(['OFFICE SUPPLIES', 'TRAVEL EXP'], rows),
+    })
+    for i in range(16):
+        ledger['Column {}'.format(i)] = i
+    with pd.ExcelWriter(os.path.join(dir, 'detail.xlsx'), engine='openpyxl') as writer:
+        pd.DataFrame({'General Ledger': ['-'] * 10}).to_excel(writer, index=False)
+        ledger.to_excel(writer, startrow=11, startcol=5, index=False)
+
+def make_pdfs(dir, pairs):
+    """XFER/FEES pairs for merge_td and cover/FEES pairs for merge_crystal."""
+    from PyPDF2 import PdfFileWriter
+    def blank(path, pages):
+        writer = PdfFileWriter()
+        for _ in range(pages):
+            writer.addBlankPage(612, 792)
+        with open(path, 'wb') as f:
+            writer.write(f)
+    os.makedirs(os.path.join(dir, 'td'))
+    os.makedirs(os.path.join(dir, 'crystal'))
+    for i in range(pairs):
+        blank(os.path.join(dir, 'td', '{} XFER.pdf'.format(i)), 1)
+        blank(os.path.join(dir, 'td', '{} FEES.pdf'.format(i)), 3)
+        blank(os.path.join(dir, 'crystal', '21-{}.pdf'.format(i)), 1)
+        blank(os.path.join(dir, 'crystal', '21-{} FEES.pdf'.format(i)), 2)
+
+@contextmanager
+def workspace():
+    """Run inside a fresh temporary directory with cold workbook and reference data caches."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as dir:
+        os.chdir(dir)
+        cache_dir = excel_io.CACHE_DIR
+        excel_io.CACHE_DIR = os.path.join(dir, '.excel_cache')
+        try:
+            yield dir
+        finally:
+            excel_io.CACHE_DIR = cache_dir
+            excel_io.clear()
+            reference_data.clear()
+            os.chdir(cwd)
+
+def timed(func, repeat):
+    """Best wall time of func over repeat calls, each starting from cold caches."""
+    best = None
+    for _ in range(repeat):
+        shutil.rmtree(excel_io.CACHE_DIR, ignore_errors=True)
+        excel_io.clear()
+        reference_data.clear()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 4)
+
+def bench_td(rows, repeat, rng):
+    from card_statements import TD
+    with workspace() as dir:
+        make_reference_data(dir, rng)
+        make_td_statement('statement.xlsx', rows, rng)
+        def run():
+            td = TD('statement.xlsx', databases=dir + '/')
+            td.fix_sheet()
+        return {'TD + fix_sheet': timed(run, repeat)}
+
+def bench_cash(rows, repeat, rng):
+    import cash
+    with workspace() as dir:
+        make_cash(dir, rows, rng)
+        ctx = cash.load_context(dir + '/')
+        df = cash.clean_data(ctx, 'cash.xlsx')
+        groups = list(df.groupby('EscrowBank'))
+        return {
+            'clean_data': timed(lambda: cash.clean_data(ctx, 'cash.xlsx'), repeat),
+            'report_data': timed(lambda: [cash.report_data(ctx, escrow, frame) for escrow, frame in groups], repeat),
+            'check_sheet': timed(lambda: cash.check_sheet('cash.xlsx', 'fee_master.xlsx'), repeat),
+        }
+
+def bench_variance(rows, repeat, rng):
+    import financial_statement_analyzer as fsa
+    with workspace() as dir:
+        make_financials(dir, rows, rng)
+        start, end = fsa.get_dates('financial_statement.xlsx')
+        run = lambda: list(fsa.parse_variance(start, 'financial_statement.xlsx', 'detail.xlsx'))
+        return {'parse_variance': timed(run, repeat)}
+
+def bench_pdf(pairs, repeat, rng):
+    import pdf_joiner
+    with workspace() as dir:
+        make_pdfs(dir, pairs)
+        return {
+            'merge_td': timed(lambda: pdf_joiner.merge_td('td'), repeat),
+            'merge_crystal': timed(lambda: pdf_joiner.merge_crystal('crystal'), repeat),
+        }
+
+BENCHMARKS = {'td': bench_td, 'cash': bench_cash, 'variance': bench_variance, 'pdf': bench_pdf}
+
+def run_benchmarks(sizes, names=None, repeat=1, seed=0):
+    """
+    Time every benchmark at every size on freshly generated inputs. Sizes are rows of input for the spreadsheet
+    benchmarks and a fiftieth of that in pdf pairs. Returns a JSON-ready dict of the results.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        for name in names or BENCHMARKS:
+            units = max(size // 50, 1) if name == 'pdf' else size
+            for stage, seconds in BENCHMARKS[name](units, repeat, rng).items():
+                print('{:>10} {:<16} {:>8} {:>10.4f}s'.format(name, stage, units, seconds))
+                results.append({'benchmark': name, 'stage': stage, 'size': units, 'seconds': seconds})
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'excel_engine': excel_io.ENGINE or 'default',
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the journal pipelines on synthetic inputs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='run just these benchmarks')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file, defaults to benchmark_results/<timestamp>.json')
+    args = parser.parse_args()
+    report = run_benchmarks(args.sizes, args.only, args.repeat, args.seed)
+    output = args.output or os.path.join('benchmark_results', report['timestamp'].replace(':', '-') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to', output)
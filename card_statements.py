@@ -1,180 +1,133 @@
 import pandas as pd
 import numpy as np
 from string import punctuation
-import pickle
 import calendar
+import excel_io
+import instrument
 import os
+import parallel
+import reference_data
+import schema
+import spreadsheet
+
+PUNCTUATION = str.maketrans(punctuation, ' ' * len(punctuation))
 
 class TD:
     """Class representing a bank statement from TD Bank."""
-    def __init__(self, path):
+    def __init__(self, path, databases=reference_data.DATABASES):
         self.path = path
-        self._accts = self.load_data('/data/workspace_files/databases/accts.pickle')
-        self._cos = self.load_data('/data/workspace_files/databases/cos.pickle')
-        self._employee = self.load_data('/data/workspace_files/databases/employee.pickle')
-        self._keywords = self.load_data('/data/workspace_files/databases/keywords.pickle')
+        self._accts = self.load_data(databases + 'accts.pickle')
+        self._cos = self.load_data(databases + 'cos.pickle')
+        self._employee = self.load_data(databases + 'employee.pickle', reference_data.employee_table)
+        self._keyword_index = self.load_data(databases + 'keywords.pickle', reference_data.keyword_index)
         self.df = self.load_df()
         self.date = self.get_posting_date()
-        self.report = pd.DataFrame({
-                                    'Type': list(self.types()),
-                                    'No': list(self.accounts()),
-                                    'State': list(self.states()),
-                                    'Branch Code': list(self.branches()),
-                                    'Dept Code': list(self.depts()),
-                                    'Description/Comment': list(self.descriptions()),
-                                    'Quantity': list(self.quantity()),
-                                    'Direct Unit Cost': list(self.costs()),
-                                    'IC Partner Ref Type': list(self.ref_type()),
-                                    'IC Partner Code': list(self.ic_partner_codes()),
-                                    'IC Partner Reference': list(self.ic_partner_refs()),
-        })
-
-    def load_data(self, filename):
-        """Load dictionaries from pickle files."""
-        with open(filename, 'rb') as f:
-            return pickle.load(f)
+        self.report = self.build_report()
+
+    def load_data(self, filename, transform=None):
+        """Load dictionaries from pickle files through the shared reference data cache."""
+        return reference_data.load(filename, transform)
 
+    @instrument.timed()
     def load_df(self):
         """Load the bank statement, drop auto payment charges made to account."""
-        df = pd.read_excel(self.path, converters={'MCC/SIC Code':str, 'Originating Account Number':str})
+        df = excel_io.read_excel(self.path, converters={'MCC/SIC Code':str, 'Originating Account Number':str})
         df = df[df['Merchant Name'] != 'AUTO PAYMENT DEDUCTION']
         return df
-    
+
+    def build_report(self):
+        """Assemble the expense posting column by column, broadcasting the constant columns."""
+        employees = self.employees()
+        return pd.DataFrame({
+                            'Type': 'G/L Account',
+                            'No': self.accounts(),
+                            'State': employees['state'],
+                            'Branch Code': employees['branch'],
+                            'Dept Code': employees['dept'],
+                            'Description/Comment': self.descriptions(),
+                            'Quantity': 1,
+                            'Direct Unit Cost': self.costs(),
+                            'IC Partner Ref Type': 'G/L Account',
+                            'IC Partner Code': employees['ic_code'],
+                            'IC Partner Reference': np.nan,
+        }, index=self.df.index).reset_index(drop=True).pipe(schema.apply, schema.TD_JOURNAL)
+
     def accounts(self):
-        """Generate Accounting codes based off of the MCC/SIC Code provided by TD."""
-        for i, cell in enumerate(self.df['MCC/SIC Code']):
-            if cell in self._accts.keys(): 
-                yield self._accts[cell]
-            else: 
-                yield np.nan
-
-    def types(self):
-        """Yield G/L Account values for each entry in the dataframe."""
-        for _ in range(len(self.df)): 
-            yield 'G/L Account'
-
-    def states(self):
-        """Yield state codes based off last 4 digits of account number and branch that account is linked to."""
-        for i, cell in enumerate(self.df['Originating Account Number']):
-            k = str(cell)[-4:]
-            if k in self._employee.keys(): 
-                yield self._employee[k]['state']
-            else: 
-                yield np.nan
-
-    def ref_type(self):
-        """Yield G/L Account values for each entry in the dataframe."""
-        for i, cell in enumerate(self.df['Account Number']):
-            yield 'G/L Account'
-
-    def branches(self):
-        """Yield company branch code based on the last 4 digits of the card number."""
-        for i, cell in enumerate(self.df['Originating Account Number']):
-            k = str(cell)[-4:]
-            if k in self._employee.keys(): 
-                yield self._employee[k]['branch']
-            else: 
-                yield np.nan
+        """Accounting codes based off of the MCC/SIC Code provided by TD."""
+        return self.df['MCC/SIC Code'].map(self._accts)
+
+    def employees(self):
+        """
+        Employee state, branch, dept and ic_code for each entry, joined on the last 4 digits of the card number.
+        Cards that aren't linked to an employee get NaN in every column.
+        """
+        suffix = self.df['Originating Account Number'].map(str).str[-4:]
+        return self._employee.reindex(suffix.values).set_axis(self.df.index)
 
     def descriptions(self):
         """Get the descriptions from the bank statement, combine with initials of the purchasing agent."""
-        L = [cell for i, cell in enumerate(self.df['Merchant Name'])]
-        for i, cell in enumerate(self.df['Originating Account Name']):
-            if str(cell) == 'nan': 
-                continue
-            else:
-                if len(cell.split()) == 2 and cell != 'COMMERCIAL DEPARTMENT':
-                    name = cell.split()
-                    initials = name[0][0] + name[1][0]
-                    L[i] = '{}-{}'.format(initials, L[i])
-                else: 
-                    continue
-        for descr in L: 
-            yield descr
-
-    def quantity(self):
-        """Yield an int 1 value for each row in the bank statement."""
-        for _ in range(len(self.df)): 
-            yield 1
+        merchants = self.df['Merchant Name']
+        names = self.df['Originating Account Name'].astype(object)
+        words = names.str.split()
+        agent = (words.str.len() == 2) & (names != 'COMMERCIAL DEPARTMENT')
+        initials = words.str[0].str[0] + words.str[1].str[0]
+        return merchants.where(~agent, initials + '-' + merchants.map(str))
 
     def costs(self):
-        """List amounts provided by the TD Bank Statement."""
-        for i, cell in enumerate(self.df['Original Amount']): 
-            yield round(cell, 2)
-
-    def ic_partner_codes(self):
-        """Yield intercompany codes for purchases made from a partnered branch."""
-        for i, cell in enumerate(self.df['Originating Account Number']):
-            k = str(cell)[-4:]
-            if k in self._employee.keys():
-                yield self._employee[k]['ic_code']
-            else:
-                yield np.nan
-
-    def ic_partner_refs(self):
-        """Yield blank values for the length of the spreadsheet."""
-        for _ in range(len(self.df)):
-            yield np.nan
-
-    def depts(self):
-        """Yield proper department code determined by the last 4 digits of the card number and corresponding agent."""
-        # create conversion table based on accounting code / employee
-        for i, cell in enumerate(self.df['Originating Account Number']): 
-            k = str(cell)[-4:]
-            if k in self._employee.keys():
-                yield self._employee[k]['dept']
-            else:
-                yield np.nan
+        """Amounts provided by the TD Bank Statement."""
+        return self.df['Original Amount'].round(2)
 
     def get_posting_date(self):
         """Get the posting date, the last day of the month the bank statement is accounting for."""
         date = self.df.iloc[0, 0]
         return '{}/{}/{}'.format(date.month, calendar.monthrange(date.year, date.month)[1], date.year)
 
+    @instrument.timed(rows=lambda result, td: len(td.report))
     def fix_sheet(self):
         """
         Once Account values are generated based off of MCC/SIC Code, scan through the list of company keywords
         replacing values that vary from the translation in previous card statements. Also corrects state and department
         codes for specific accounting code values to fix errors.
         """
-        for i, cell in enumerate(self.report['Description/Comment']):
-            for char in punctuation:
-                if char in cell:
-                    cell = cell.replace(char, ' ')
-            for word in cell.split():
-                for k, v in self._keywords.items():
-                    if word in v:
-                        self.report.loc[i, 'No'] = k
-        self.report.loc[self.report[self.report['Direct Unit Cost'] < 0].index.tolist(), 'No'] = '19999'
-        self.report.loc[self.report[self.report['No'] == '63000'].index.tolist(), 'Dept Code'] = '00'
-        self.report.loc[self.report[self.report['No'] == '63003'].index.tolist(), 'Dept Code'] = '00'
-        self.report.loc[self.report[self.report['Description/Comment'] == 'STANDARD VCF 4.4 100'].index.tolist(), 'No'] = '63004'
-        self.report.loc[self.report[self.report['Description/Comment'] == 'STANDARD VCF 4.4 100'].index.tolist(), 'State'] = '00'
-        self.report.loc[self.report[self.report['Description/Comment'] == 'STANDARD VCF 4.4 100'].index.tolist(), 'Branch Code'] = '000'
-        self.report.loc[self.report[self.report['Description/Comment'] == 'STANDARD VCF 4.4 100'].index.tolist(), 'Dept Code'] = '00'
-
-
-def generate_td(dir='td_statements'):
+        report = schema.codes_as_objects(self.report, schema.TD_JOURNAL)
+        words = report['Description/Comment'].str.translate(PUNCTUATION).str.split().explode()
+        matches = words.map(self._keyword_index).dropna()
+        last = matches.groupby(level=0).last()
+        report.loc[last.index, 'No'] = last
+
+        report.loc[report['Direct Unit Cost'] < 0, 'No'] = '19999'
+        report.loc[report['No'].isin(['63000', '63003']), 'Dept Code'] = '00'
+        vcf = report['Description/Comment'] == 'STANDARD VCF 4.4 100'
+        report.loc[vcf, ['No', 'State', 'Branch Code', 'Dept Code']] = ['63004', '00', '000', '00']
+        self.report = schema.apply(report, schema.TD_JOURNAL)
+
+
+def process_statement(path):
+    """Parse a single bank statement once, returning the corrected report and its posting date."""
+    td = TD(path)
+    td.fix_sheet()
+    return td.report, td.date
+
+def generate_td(dir='td_statements', workers=None):
     """
     Load each bank statement from the directory, gather the proper sheetname from the statement title,
-    run through the TD class and create a new sheet in the workbook for the expenses posting.
+    run through the TD class and create a new sheet in the workbook for the expenses posting. Statements are
+    parsed in a pool of `workers` processes, workers=1 processes them one at a time.
     """
-    frames = []
-    filename = ''
-    for file in os.listdir(dir):
-        sheet = file.split('TD CARD')[0].strip().split()[0]
-        if not dir.endswith('/'): 
-            dir += '/'
-        td = TD(dir + file)
-        td.fix_sheet()
-        filename = 'journals/' + TD(dir + file).date.replace('/','_') + ' TD_Statements.xlsx'
-        frames.append((td.report, sheet))
+    if not dir.endswith('/'): 
+        dir += '/'
+    files = os.listdir(dir)
+    results = parallel.pmap(process_statement, [dir + file for file in files], workers=workers)
 
+    frames = [(report, file.split('TD CARD')[0].strip().split()[0]) for file, (report, date) in zip(files, results)]
     frames = sorted(frames, key=lambda x: x[1])
-    
-    with pd.ExcelWriter(filename) as writer:
-        for i in range(len(frames)): 
-            frames[i][0].to_excel(writer, sheet_name=frames[i][1], index=False)
+    filename = 'journals/' + results[-1][1].replace('/','_') + ' TD_Statements.xlsx'
+
+    with spreadsheet.Workbook(filename) as workbook:
+        for report, sheet in frames:
+            workbook.add_sheet(sheet, report)
 
 if __name__ == '__main__':
-    generate_td()
+    import cli
+    import sys
+    sys.exit(cli.main(['td'] + sys.argv[1:]))
@@ -1,43 +1,50 @@
 import pandas as pd
 import numpy as np
+from collections import namedtuple
+import excel_io
+import instrument
 import os
-import pickle
+import parallel
+import posted
+import reference_data
+import schema
+import spreadsheet
 
+CASH_CONVERTERS = {'AcctCode':str, 'TitleCoNum':str}
+JOURNAL_COLUMNS = [(0, 2, 12), (3, 3, 3), (4, 5, 7), (6, 6, 15), (7, 7, 21), (8, 9, 9, {'num_format':'##0.00'})]
 
-def load_pickle(file):
-    with open(file, 'rb') as f:
-        return pickle.load(f)
 
-def get_state(cell):
-    if cell.startswith('CS'):
-        return '01'
-    else:
-        if cell.split('-')[-1].isnumeric() and len(cell.split('-')[-1]) == 2:
-            return cell.split('-')[-1]
-        elif cell.split('-')[-1] == 'R':
-            return '01'
-        else:
-            return cell.split('-')[-1][:-1]
-
-def get_dept(cell):
-    if cell.startswith('6'):
-        return '02'
-    else:
-        return '00'
+Context = namedtuple('Context', ['branches', 'closing', 'accounts'])
 
-def debits(cell):
-    if cell < 0:
-        return round(abs(cell), 2)
-    else:
-        return np.nan
 
-def credits(cell):
-    if cell >= 0:
-        return round(cell, 2)
-    else:
-        return np.nan
+def load_pickle(file):
+    return reference_data.load(file)
 
-def report(escrow, df):
+def load_context(dir='data/'):
+    """Load the branch, closing and escrow account tables the journal functions run against."""
+    return Context(branches=load_pickle(dir + 'branches.pickle'),
+                   closing=load_pickle(dir + 'closing.pickle'),
+                   accounts=load_pickle(dir + 'accounts.pickle'))
+
+def get_states(file_numbers):
+    """
+    State code for each file number, parsed once per distinct file number. CS files and files ending in -R are
+    '01', a two digit suffix is the state code itself, otherwise the suffix less its last character.
+    """
+    codes, files = pd.factorize(file_numbers)
+    files = pd.Series(files, dtype=object)
+    suffix = files.str.rsplit('-', n=1).str[-1]
+    states = suffix.str[:-1]
+    states = states.mask(suffix == 'R', '01')
+    states = states.mask(suffix.str.isnumeric() & (suffix.str.len() == 2), suffix)
+    states = states.mask(files.str.startswith('CS'), '01')
+    return states.reindex(codes).set_axis(file_numbers.index)
+
+def get_depts(acct_codes):
+    return pd.Series(np.where(acct_codes.str.startswith('6'), '02', '00'), index=acct_codes.index)
+
+@instrument.timed()
+def report(ctx, escrow, df):
     cash = df[~df.AcctCode.isin(['66302','66300'])]
     shorts = df[df.AcctCode.isin(['66302', '66300'])]
 
@@ -49,16 +56,18 @@ def report(escrow, df):
     }).reset_index()
 
     df = pd.concat([frame, shorts], ignore_index=True)
-    df['Type'] = ['G/L Account'] * len(df)
-    df['Account Desr'] = ['{} {}'.format(df['File Number'][i], df['CloseAgent'][i]) if df.AcctCode[i] in ['66300','66302'] else np.nan for i in range(len(df))]
-    df['Description Reference'] = ['{} RQ DEP'.format(df['Date'][i]) for i in range(len(df))]
-    df['Debits'] = df['Invoice Line Total'].apply(debits)
-    df['Credits'] = df['Invoice Line Total'].apply(credits)
+    amounts = df['Invoice Line Total']
+    df['Type'] = 'G/L Account'
+    df['Account Desr'] = (df['File Number'].astype(str) + ' ' + df['CloseAgent'].astype(str)).where(
+        df.AcctCode.isin(['66300','66302']))
+    df['Description Reference'] = df['Date'] + ' RQ DEP'
+    df['Debits'] = amounts.where(amounts < 0).abs().round(2)
+    df['Credits'] = amounts.where(amounts >= 0).round(2)
 
     totals = pd.DataFrame({
         'Date': df['Date'][0],
         'Type': ['Bank Account'],
-        'AcctCode': [accounts[escrow]['bank']],
+        'AcctCode': [ctx.accounts[escrow]['bank']],
         'St': ['00'],
         'Branch': ['000'],
         'Dept': ['00'],
@@ -73,75 +82,79 @@ def report(escrow, df):
 
     return df[['Date','Type','Account','St','Branch','Dept','Account Desr','Description Reference','Debits','Credits']]
 
-def totals(escrow, df):
-    debits, credits, states = list(), list(), list()
-    accounts, branches = list(), list()
-    dates, description_references = list(), list()
-    for (tco, date, branch, st, oc), frame in df.groupby(['TitleCoNum', 'Date', 'Branch', 'St','OrderCategory']):
-        if oc in [1,4]:
-            debits.append(round(frame['Invoice Line Total'].sum(), 2))
-            debits.append(len(set(frame[frame.AcctCode == '40000']['File Number'])) - len(set(frame[(frame.SortField == 2) & (frame.AcctCode == '40000')]['File Number'])))
-        elif oc in [2,5]:
-            debits.append(round(frame['Invoice Line Total'].sum(), 2))
-            debits.append(len(set(frame[frame.AcctCode == '40002']['File Number'])) - len(set(frame[(frame.SortField == 2) & (frame.AcctCode == '40002')]['File Number'])))
-        else:
-            debits.append(round(frame['Invoice Line Total'].sum(), 2))
-            debits.append(len(set(frame['File Number'].tolist())))
-        accounts.append(closing[oc]['revenue'])
-        accounts.append(closing[oc]['count'])
-        credits += [np.nan] * 2
-        states += [st] * 2
-        branches += [branch] * 2
-        dates += [date] * 2
-        description_references += ['{} RQ DEP'.format(date)] * 2
-    
-    dates.append(date)
-
-    description_references.append('{} RQ DEP'.format(date))
-    branches.append('000')
-    states.append('00')
-    accounts.append('99998')
-    debits.append(np.nan)
-    credits.append(np.nan)
-    
-    report =  pd.DataFrame({'Date': dates,
-                            'Type': ['G/L Account'] * len(debits),
-                            'Account': accounts,
-                            'St': states,
-                            'Branch': branches,
-                            'Dept': ['00'] * len(debits),
-                            'Description Reference': description_references,
-                            'Debits': debits,
-                            'Credits': credits})
-    
+@instrument.timed()
+def totals(ctx, escrow, df):
+    """
+    Revenue and new file count lines for every TitleCoNum/Date/Branch/St/OrderCategory group, computed in one grouped
+    pass and followed by the 99998 line. Order categories 1/4 and 2/5 only count files with a 40000 or 40002 line
+    respectively, less the files that are second invoices.
+    """
+    title_orders = df.OrderCategory.isin([1,4])
+    escrow_orders = df.OrderCategory.isin([2,5])
+    counted = ((title_orders & (df.AcctCode == '40000')) | (escrow_orders & (df.AcctCode == '40002'))
+               | ~(title_orders | escrow_orders))
+    seconds = counted & (title_orders | escrow_orders) & (df.SortField == 2)
+
+    groups = df.assign(Counted=df['File Number'].where(counted), Seconds=df['File Number'].where(seconds)).groupby(
+        ['TitleCoNum', 'Date', 'Branch', 'St', 'OrderCategory']).agg(
+            Revenue=('Invoice Line Total', 'sum'),
+            Files=('Counted', 'nunique'),
+            Seconds=('Seconds', 'nunique'),
+    ).reset_index()
+
+    revenue = groups[['Date', 'St', 'Branch']].assign(
+        Account=groups.OrderCategory.map(lambda oc: ctx.closing[oc]['revenue']),
+        Debits=groups.Revenue.round(2))
+    count = groups[['Date', 'St', 'Branch']].assign(
+        Account=groups.OrderCategory.map(lambda oc: ctx.closing[oc]['count']),
+        Debits=groups.Files - groups.Seconds)
+    date = groups.Date.iloc[-1]
+    last = pd.DataFrame({'Date': [date], 'St': ['00'], 'Branch': ['000'], 'Account': ['99998'], 'Debits': [np.nan]})
+
+    report = pd.concat([revenue, count]).sort_index(kind='mergesort')
+    report = pd.concat([report, last], ignore_index=True)
+    report['Type'] = 'G/L Account'
+    report['Dept'] = '00'
+    report['Description Reference'] = report.Date + ' RQ DEP'
+    report['Credits'] = np.nan
+    report = report[['Date','Type','Account','St','Branch','Dept','Description Reference','Debits','Credits']]
+
     report = report[~report.Account.str.startswith('?')]
     report = report[report.Debits != 0]
     return report
 
-def clean_data(filename):
+@instrument.timed()
+def clean_data(ctx, filename):
     if filename.endswith('csv'):
-        df = pd.read_csv(filename, converters={'AcctCode':str, 'TitleCoNum':str})
+        df = pd.read_csv(filename, converters=CASH_CONVERTERS)
     else:
-        df = pd.read_excel(filename, converters={'AcctCode':str, 'TitleCoNum':str})
+        df = excel_io.read_excel(filename, converters=CASH_CONVERTERS)
         
     
-    df['Branch'] = df.TitleCoNum.map(lambda x: branches[x] if x in branches.keys() else '000')
-    df['St'] = df['File Number'].apply(get_state)
-
-    df.AcctCode.replace('40003', '40000', inplace=True)
-    df.OrderCategory.replace(25, 8, inplace=True)
-    df.dropna(subset=['Invoice Line Total'], inplace=True)
-
-    df.loc[df[(df.AcctCode == '40000') & (df.OrderCategory.isin([2,5]))].index.tolist(), 'AcctCode'] = '40002'
-
-    df['Dept'] = df.AcctCode.apply(get_dept)
+    df = posting_lines(df)
+    df['Branch'] = df.TitleCoNum.map(ctx.branches).fillna('000')
+    df['St'] = get_states(df['File Number'])
+    df['Dept'] = get_depts(df.AcctCode)
     df['Date'] = pd.to_datetime(df['PaymentDate']).dt.strftime('%m/%d/%Y')
+    return df
 
-    return df[df['Invoice Line Total'] != 0]
+def posting_lines(df):
+    """Lines of a cash export that get posted, with the account codes and order categories they are posted under."""
+    df = df.assign(AcctCode=df.AcctCode.replace('40003', '40000'), OrderCategory=df.OrderCategory.replace(25, 8))
+    df = df.dropna(subset=['Invoice Line Total'])
+    df.loc[(df.AcctCode == '40000') & (df.OrderCategory.isin([2,5])), 'AcctCode'] = '40002'
+    return df[df['Invoice Line Total'] != 0].copy()
 
-def get_filename(df):
+def get_filename(df, unique=False):
+    """Journal workbook for the first deposit date in df. unique numbers it past any journal already written."""
     os.makedirs('cash_receipts/', exist_ok=True)
-    return 'cash_receipts/{} cash_receipts.xlsx'.format(df['Date'][0].replace('/','_'))
+    date = df['Date'][0].replace('/','_')
+    filename = 'cash_receipts/{} cash_receipts.xlsx'.format(date)
+    n = 1
+    while unique and os.path.exists(filename):
+        n += 1
+        filename = 'cash_receipts/{} cash_receipts {}.xlsx'.format(date, n)
+    return filename
 
 def fix_accounts(escrow, df):
     """Fix Account numbers for specific companies before creating sheet."""
@@ -152,45 +165,49 @@ def fix_accounts(escrow, df):
         df.loc[df[df.Account == '43502'].index.tolist(), 'Account'] = '43501'
     return df
 
-def report_data(escrow, df):
-    frame1 = report(escrow, df)
-    frame2 = totals(escrow, df)
+def report_data(ctx, escrow, df):
+    frame1 = report(ctx, escrow, df)
+    frame2 = totals(ctx, escrow, df)
     journal = pd.concat([frame1, frame2], ignore_index=True)
-    journal = fix_accounts(escrow, journal)
+    journal = schema.apply(fix_accounts(escrow, journal), schema.CASH_JOURNAL)
     s = journal[journal.Type == 'Bank Account'].index.values[0] + 3
     e = journal[journal.Account == '99998'].index.values[0] + 1
     f = '=SUM(I{}:I{})'.format(s,e)
-    sheet = accounts[escrow]['sheet']
-    return journal, accounts[escrow]['sheet'], f, e
+    return journal, ctx.accounts[escrow]['sheet'], f, e
 
+@instrument.timed(rows=lambda result, filename, arr: sum(len(x[0]) for x in arr))
 def create_spreadsheet(filename, arr):
-    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+    with spreadsheet.Workbook(filename) as workbook:
         print('Creating', filename.split('/')[-1] + '...')
-        for i in range(len(arr)):
-            print('Adding sheet', arr[i][1] + '...')
-            arr[i][0].to_excel(writer, sheet_name=arr[i][1], index=False)
-            workbook = writer.book
-            worksheet = writer.sheets[arr[i][1]]
-            num_format = workbook.add_format({'num_format':'##0.00'})
-            worksheet.set_column(0, 2, 12)
-            worksheet.set_column(3, 3, 3)
-            worksheet.set_column(4, 5, 7)
-            worksheet.set_column(6, 6, 15)
-            worksheet.set_column(7, 7, 21)
-            worksheet.set_column('I:J', 9, cell_format=num_format)
-            worksheet.write_formula('J{}'.format(arr[i][-1] + 1), arr[i][-2])
+        for journal, sheet, formula, row in arr:
+            print('Adding sheet', sheet + '...')
+            workbook.add_sheet(sheet, journal, columns=JOURNAL_COLUMNS, formulas=[('J{}'.format(row + 1), formula)])
         print('{} finished'.format(filename.split('/')[-1]))
 
+def reconcile(cash, fees):
+    """
+    Compare the invoice totals posted per file number against the amounts transferred in the fee master. Returns
+    the discrepancies, one row per file, with the posted and transferred totals, where the file was found
+    ('both', 'cash' or 'fees') and the rounded amount it is off by.
+    """
+    posted = cash.groupby('File Number')['Invoice Line Total'].sum().rename('Posted')
+    transferred = fees.groupby('File')['Amount'].sum().rename('Transferred')
+    table = pd.concat([posted, transferred], axis=1)
+    table.index.name = 'File'
+    table['Source'] = np.select([table.Posted.isna(), table.Transferred.isna()], ['fees', 'cash'], 'both')
+    table['Off'] = (table.Transferred.fillna(0) - table.Posted.fillna(0)).round(2)
+    table = table[table.Posted.fillna(0).round(2) != table.Transferred.fillna(0).round(2)]
+    return table.reset_index()
+
+@instrument.timed(rows=lambda *args: None)
 def check_sheet(cash='sheets/cash.xls', fees='sheets/fee_master.xlsx', master=True):
     """
     Scans the worksheet and returns errors if any. if master is set to True it accounts that each file number in the master
     worksheet has been accounted for and the proper amount has been recorded.
     """
     errors, revisions = [],[]
-    fees = pd.read_excel(fees)
-    cash = pd.read_excel(cash)
-
-    fee_files = set(fees['File'])
+    fees = excel_io.read_excel(fees)
+    cash = excel_io.read_excel(cash, converters=CASH_CONVERTERS)
 
     second_invoices = cash[(cash.SortField == 2) & (cash.AcctCode.isin(['40000','40002']))]
     for x in second_invoices['File Number'].unique():
@@ -202,47 +219,89 @@ def check_sheet(cash='sheets/cash.xls', fees='sheets/fee_master.xlsx', master=Tr
             errors.append('{} has no order category'.format(x))
 
     if master:
-        for file in fee_files:
-            posted = cash[cash['File Number'] == file]['Invoice Line Total'].sum()
-            transferred = fees[fees['File'] == file]['Amount'].sum()
-            if not round(posted, 2) == round(transferred, 2):
-                errors.append(f'{file} is off {round(transferred - posted, 2)}')
+        discrepancies = reconcile(cash, fees)
+        for row in discrepancies[discrepancies.Source != 'cash'].itertuples():
+            errors.append(f'{row.File} is off {row.Off}')
     return errors, revisions
 
-def check_balances(filename):
-    xl = pd.ExcelFile(filename)
-    for sheet in xl.sheet_names:
-        df = xl.parse(sheet)
-        rev_accts = [closing[x]['revenue'] for x in closing.keys()]
-        x = round(df[df.Account.isin(rev_accts)]['Debits'].sum(), 2)
-        y = round(df[df.Type == 'Bank Account']['Debits'].sum(), 2)
-        if not x == y:
-            print(sheet, 'Revenue Accounts:', x, 'Bank Account:', y)
-
-def generate_journal(filename='sheets/cash.xls'):
-    errors, revisions = check_sheet(master=True)
-    if errors:
-        for error in errors:
-            print(error)
-        return None
-    for revision in revisions:
-        print(revision)
-
-    df = clean_data(filename)
-    filename = get_filename(df)
-
-    arr = list()
-    for escrow, frame in df.groupby('EscrowBank'):
-        arr.append(report_data(escrow, frame))
+def validate_balances(ctx, arr):
+    """
+    Compare revenue account debits against the bank account deposit for every journal in one grouped pass. Returns
+    one row per sheet with both rounded totals and whether they balance.
+    """
+    rev_accts = [ctx.closing[x]['revenue'] for x in ctx.closing.keys()]
+    journals = pd.concat([x[0] for x in arr], keys=[x[1] for x in arr], names=['Sheet', None])
+    balances = pd.DataFrame({
+        'Revenue': journals.Debits.where(journals.Account.isin(rev_accts), 0),
+        'Bank': journals.Debits.where(journals.Type == 'Bank Account', 0),
+    }).groupby(level='Sheet', sort=False).sum().round(2)
+    balances['Balanced'] = balances.Revenue == balances.Bank
+    return balances.reset_index()
+
+def print_balances(balances):
+    for row in balances[~balances.Balanced].itertuples():
+        print(row.Sheet, 'Revenue Accounts:', row.Revenue, 'Bank Account:', row.Bank)
+
+def check_balances(ctx, filename):
+    """Re-read a written journal workbook and run the balance validation against what actually landed on disk."""
+    sheets = excel_io.read_excel(filename, sheet_name=None, converters={'Account':str})
+    print_balances(validate_balances(ctx, [(df, sheet) for sheet, df in sheets.items()]))
+
+def generate_journal(filename='sheets/cash.xls', ctx=None, workers=None, verify_output=False, store=None):
+    """
+    Build the cash receipts journal, one sheet per escrow bank. Escrows are reported in a pool of `workers`
+    processes, workers=1 reports them one at a time. Balances are validated on the journals in memory before
+    they are written; verify_output re-reads the written workbook and validates it again.
+
+    Given the path of a posted lines store, only lines not already posted are journaled, one workbook per deposit
+    date, and each line is recorded in the store once its journal has been written.
+    """
+    if ctx is None:
+        ctx = load_context()
+    conn = posted.connect(store) if store else None
+    try:
+        errors, revisions = check_sheet(cash=filename, master=True)
+        if errors:
+            for error in errors:
+                print(error)
+            return None
+        for revision in revisions:
+            print(revision)
+
+        df = clean_data(ctx, filename)
+        if conn is None:
+            write_journal(ctx, df, workers, verify_output)
+            return
+
+        keys = posted.line_keys(df)
+        new = posted.unseen(conn, keys)
+        if not new.any():
+            print('No new cash receipts to post')
+        for date, day in df[new].groupby(keys.payment_date[new], sort=True):
+            journal = write_journal(ctx, day.reset_index(drop=True), workers, verify_output, unique=True)
+            posted.record(conn, keys.loc[day.index], journal)
+    finally:
+        if conn is not None:
+            conn.close()
+
+def write_journal(ctx, df, workers=None, verify_output=False, unique=False):
+    """Report, validate and write the journal for the cleaned lines in df, returning the workbook written."""
+    filename = get_filename(df, unique)
+
+    escrows, frames = zip(*df.groupby('EscrowBank'))
+    arr = parallel.pmap(report_data, [ctx] * len(escrows), escrows, frames, workers=workers)
 
     arr = sorted(arr, key=lambda x: x[1])
-    
+
+    print_balances(validate_balances(ctx, arr))
+
     create_spreadsheet(filename, arr)
 
-    check_balances(filename)
+    if verify_output:
+        check_balances(ctx, filename)
+    return filename
 
 if __name__ == '__main__':
-    branches = load_pickle('data/branches.pickle')
-    closing = load_pickle('data/closing.pickle')
-    accounts = load_pickle('data/accounts.pickle')
-    generate_journal()
+    import cli
+    import sys
+    sys.exit(cli.main(['cash'] + sys.argv[1:]))
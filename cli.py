@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import sys
+import traceback
+import instrument
+
+def run_td(args):
+    import card_statements
+    card_statements.generate_td(args.td_dir, workers=args.workers)
+
+def run_cash(args):
+    import cash
+    cash.generate_journal(args.cash, workers=args.workers, verify_output=args.verify_output, store=args.store)
+
+def variance_records(args):
+    import financial_statement_analyzer as fsa
+    if args.batch:
+        return fsa.batch_variance(args.batch, threshold=args.threshold, chunksize=args.chunksize)
+    start, end = fsa.get_dates(args.statement)
+    return fsa.variance_records(start, args.statement, args.detail, threshold=args.threshold,
+                                chunksize=args.chunksize)
+
+def print_variance(args, records):
+    import financial_statement_analyzer as fsa
+    for record in records:
+        print(record['note'])
+        print()
+    if args.output:
+        fsa.write_notes(records, args.output)
+
+def run_variance(args):
+    print_variance(args, variance_records(args))
+
+def run_merge_td(args):
+    import pdf_joiner
+    pdf_joiner.merge_td(args.xfer_dir, workers=args.workers, incremental=args.incremental)
+
+def run_merge_crystal(args):
+    import pdf_joiner
+    pdf_joiner.merge_crystal(args.crystal_dir, workers=args.workers, incremental=args.incremental)
+
+def run_close(args):
+    """
+    Run every month close stage in this process so reference tables and parsed workbooks are loaded once and shared.
+    The stages are independent and run concurrently unless --sequential is given. PDF merges run only for the
+    folders given. Variance notes are printed once every stage has finished.
+    """
+    stages = {
+        'td': lambda: run_td(args),
+        'cash': lambda: run_cash(args),
+        'variance': lambda: variance_records(args),
+    }
+    if args.xfer_dir:
+        stages['merge-td'] = lambda: run_merge_td(args)
+    if args.crystal_dir:
+        stages['merge-crystal'] = lambda: run_merge_crystal(args)
+
+    results, failed = {}, []
+    with ThreadPoolExecutor(max_workers=1 if args.sequential else len(stages)) as executor:
+        futures = {name: executor.submit(instrument.timed(name)(stage)) for name, stage in stages.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception:
+                print('{} failed:'.format(name), file=sys.stderr)
+                traceback.print_exc()
+                failed.append(name)
+
+    if 'variance' in results:
+        print_variance(args, results['variance'])
+    return 1 if failed else 0
+
+def add_variance_arguments(parser):
+    parser.add_argument('--statement', default='data/financial_statement.xlsx')
+    parser.add_argument('--detail', default='data/detail.xlsx')
+    parser.add_argument('--batch', metavar='DIR', help='directory of periods, one subdirectory per statement')
+    parser.add_argument('--threshold', type=float, default=500)
+    parser.add_argument('--output', help='also write the variance notes to a .csv or .json file')
+    parser.add_argument('--chunksize', type=int, help='stream the general ledger this many rows at a time')
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--workers', type=int, default=None, help='processes per stage, 1 runs in-process')
+    common.add_argument('--trace', action='store_true', help='print per-stage timings when done')
+    common.add_argument('--trace-file', help='also write the stage timings to a JSON trace file')
+    common.add_argument('--trace-memory', action='store_true', help='record peak memory per stage (slower)')
+
+    parser = argparse.ArgumentParser(description='Month close journals, variance notes and statement backups.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    td = commands.add_parser('td', help='TD card statements journal', parents=[common])
+    td.add_argument('td_dir', nargs='?', default='td_statements')
+    td.set_defaults(func=run_td)
+
+    cash = commands.add_parser('cash', help='daily cash receipts journal', parents=[common])
+    cash.add_argument('cash', nargs='?', default='sheets/cash.xls')
+    cash.add_argument('--verify-output', action='store_true', help='re-read the written workbook and check its balances')
+    cash.add_argument('--store', help='posted lines store; only journal lines not posted yet, one workbook per date')
+    cash.set_defaults(func=run_cash)
+
+    variance = commands.add_parser('variance', help='explain expense variances from the general ledger', parents=[common])
+    add_variance_arguments(variance)
+    variance.set_defaults(func=run_variance)
+
+    merge_td = commands.add_parser('merge-td', help='combine XFER cover pages with FEES pdfs into fees/', parents=[common])
+    merge_td.add_argument('xfer_dir')
+    merge_td.add_argument('--incremental', action='store_true', help='only re-merge pairs whose inputs changed')
+    merge_td.set_defaults(func=run_merge_td)
+
+    merge_crystal = commands.add_parser('merge-crystal', help='combine receivable backups with FEES pdfs into final/', parents=[common])
+    merge_crystal.add_argument('crystal_dir')
+    merge_crystal.add_argument('--incremental', action='store_true', help='only re-merge pairs whose inputs changed')
+    merge_crystal.set_defaults(func=run_merge_crystal)
+
+    close = commands.add_parser('close', help='run every month close stage in one process', parents=[common])
+    close.add_argument('--td-dir', default='td_statements')
+    close.add_argument('--cash', default='sheets/cash.xls')
+    close.add_argument('--verify-output', action='store_true', help='re-read the cash workbook and check its balances')
+    close.add_argument('--store', help='posted lines store for the cash journal; only journal lines not posted yet')
+    add_variance_arguments(close)
+    close.add_argument('--xfer-dir', help='also merge the TD statement pdfs in this folder')
+    close.add_argument('--crystal-dir', help='also merge the receivable backup pdfs in this folder')
+    close.add_argument('--incremental', action='store_true', help='only re-merge pdf pairs whose inputs changed')
+    close.add_argument('--sequential', action='store_true', help='run the stages one after another')
+    close.set_defaults(func=run_close)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace or args.trace_file:
+        instrument.enable(memory=args.trace_memory)
+    try:
+        return args.func(args) or 0
+    finally:
+        instrument.report(args.trace_file)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from importlib.util import find_spec
+import glob
+import hashlib
+import os
+import pandas as pd
+
+ENGINE = 'calamine' if find_spec('python_calamine') else None
+PARQUET = find_spec('pyarrow') is not None
+
+CACHE_DIR = os.environ.get('EXCEL_CACHE_DIR', '.excel_cache')
+
+_memo = {}
+
+def describe(value):
+    """Stable text for read options, naming converters instead of using their address-bearing repr."""
+    if callable(value):
+        return '{}.{}'.format(getattr(value, '__module__', ''), getattr(value, '__qualname__', repr(value)))
+    if isinstance(value, dict):
+        return '{' + ', '.join('{}: {}'.format(describe(k), describe(v)) for k, v in sorted(value.items(), key=repr)) + '}'
+    if isinstance(value, (list, tuple, range)):
+        return '[' + ', '.join(describe(v) for v in value) + ']'
+    return repr(value)
+
+def digest(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def cache_key(path, **kwargs):
+    """
+    Key a parsed sheet by the workbook's path, its mtime and size with the engine parsing it, and every option it
+    was read with. Engines type some cells differently, so a sheet parsed by another engine counts as another version.
+    Each part is hashed separately, as path.version.options, so the entries left by older versions can be found.
+    """
+    stat = os.stat(path)
+    return '.'.join([digest(os.path.abspath(path)), digest(describe([stat.st_mtime_ns, stat.st_size, ENGINE])),
+                     digest(describe(kwargs))])
+
+def read_excel(path, sheet_name=0, cache=True, **kwargs):
+    """
+    Drop-in for pd.read_excel. Uses calamine when it is installed and keeps every parsed sheet twice: in memory for
+    repeated reads within a run, and as Parquet under CACHE_DIR so re-runs skip parsing the workbook. Callers get a
+    copy and may modify it freely. Reads of several sheets at once (sheet_name=None or a list) are not cached.
+    """
+    if not cache or sheet_name is None or isinstance(sheet_name, list):
+        return pd.read_excel(path, sheet_name=sheet_name, engine=ENGINE, **kwargs)
+    key = cache_key(path, sheet_name=sheet_name, **kwargs)
+    if key not in _memo:
+        _memo[key] = load(path, key, sheet_name, kwargs)
+    return _memo[key].copy()
+
+def load(path, key, sheet_name, kwargs):
+    """Read a sheet from the Parquet cache, falling back to parsing the workbook and caching the result."""
+    cached = os.path.join(CACHE_DIR, key + '.parquet')
+    if PARQUET and os.path.exists(cached):
+        return pd.read_parquet(cached)
+    df = pd.read_excel(path, sheet_name=sheet_name, engine=ENGINE, **kwargs)
+    if PARQUET:
+        prune(key)
+        store(df, cached)
+    return df
+
+def prune(key):
+    """Delete the cached sheets of older versions of the workbook key belongs to, so each path keeps one version."""
+    path, version, options = key.split('.')
+    for cached in glob.glob(os.path.join(CACHE_DIR, path + '.*.parquet')):
+        if os.path.basename(cached).split('.')[1] != version:
+            try:
+                os.remove(cached)
+            except FileNotFoundError:
+                pass
+
+def store(df, cached):
+    """
+    Write a parsed sheet to the Parquet cache. Frames Parquet can't represent, such as mixed-type object columns
+    or non-string headers, are simply left uncached.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    partial = '{}.{}.tmp'.format(cached, os.getpid())
+    try:
+        df.to_parquet(partial)
+        os.replace(partial, cached)
+    except (ValueError, TypeError):
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def clear():
+    """Forget the in-memory copies; the Parquet cache is left on disk."""
+    _memo.clear()
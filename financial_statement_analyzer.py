@@ -1,67 +1,212 @@
 import pandas as pd
 import numpy as np
 from dateutil import parser
-import pickle
+import excel_io
+from itertools import islice
+import json
+import os
+import reference_data
+
+DETAIL_COLUMNS = ['Acct #', 'Posting Date', 'Debit Amount', 'Vendor Name', 'G/L Description']
 
 def get_dates(path):
     """
     load financial statement into pandas. grab the start and end dates from the worksheet to filter accounting data.
     """
     flags = ['Start Date:', 'End Date:']
-    xl = pd.ExcelFile(path)
-    df = xl.parse('Inc Stmt - CMVPM - Detail')
+    df = excel_io.read_excel(path, sheet_name='Inc Stmt - CMVPM - Detail')
     df = df.iloc[1:-4, 2:]
     start, end = df[df.iloc[:, 1].isin(flags)].values[:, 2]
     return parser.parse(start), parser.parse(end)
 
-def parse_variance(start, statement='data/financial_statement.xlsx', detail='data/detail.xlsx', threshold=500):
+def index_ledger(ledger, arr):
     """
-    provide the start date, financial statement, and general ledger to scan the financial statement and examine 
-    expense differences above a desired threshold. If expenses are above the desired variance/threshold 
-    gather general ledger entries sorted by most expensive to least expensive. While the sum of these charges is
-    less than the amount of variance print statement notes to copy onto worksheet.
+    Tag every general ledger entry with the flagged summary lines its account rolls up to and sort once by line,
+    then Debit Amount from most to least expensive. Returns a map of each line's position in arr to its entries,
+    a contiguous slice of the sorted ledger.
     """
-    with open('expense_accounts.pickle', 'rb') as f:
-        D = pickle.load(f)
-        
-    df = pd.read_excel(statement, sheet_name='Inc Stmt - CMVPM - Summary')
+    accts = pd.DataFrame([(i, acct) for i, line in enumerate(arr) for acct in line[1]], columns=['Line', 'Acct #'])
+    accts = accts.drop_duplicates()
+    frame = ledger.merge(accts, on='Acct #').sort_values(['Line', 'Debit Amount'], ascending=[True, False])
+    return {line: frame.iloc[idx[0]:idx[-1] + 1] for line, idx in frame.groupby('Line', sort=False).indices.items()}
+
+def explain(frame, variance):
+    """
+    Take entries from a line's ledger, most expensive first, until their running total reaches the variance. The cut
+    is found with searchsorted over the cumulative sum of the positive amounts. Returns the entries and the amount
+    they explain, which is short of the variance when the ledger doesn't cover it.
+    """
+    amts = frame['Debit Amount'].fillna(0).to_numpy(dtype=float)
+    total = np.cumsum(np.clip(amts, 0, None))
+    if variance <= 0:
+        return frame.iloc[:0], 0
+    n = np.searchsorted(total, variance)
+    if n < len(total):
+        return frame.iloc[:n + 1], round(total[n], 2)
+    return frame[amts > 0], round(total[-1], 2) if len(total) else 0
+
+def describe(entries):
+    """Format entries as '$amount to Vendor' pairs, using the G/L description when there's no vendor name."""
+    entries = entries[entries['Debit Amount'] != 0]
+    names = entries['Vendor Name'].where(entries['Vendor Name'].notna(), entries['G/L Description'])
+    names = names.astype(object).str.lower().str.title()
+    return ', '.join('${} to {}'.format(amt, name) for amt, name in zip(entries['Debit Amount'].tolist(), names))
+
+def flagged_lines(statement, D, threshold=500):
+    """Summary lines of the financial statement whose variance meets the threshold, as (line, accounts, variance)."""
+    df = excel_io.read_excel(statement, sheet_name='Inc Stmt - CMVPM - Summary')
     df = df.iloc[2:, 2:]
 
-    arr = []
+    lines = df[df.iloc[:, 1].isin(list(D.keys()))]
+    lines = lines[lines.iloc[:, -4] >= threshold]
+    return [(cell, D[cell], round(amount, 2)) for cell, amount in zip(lines.iloc[:, 1], lines.iloc[:, -4])]
 
-    for i, cell in enumerate(df.iloc[:, 1]):
-        if cell in D.keys():
-            if df.iloc[i, 1:].values[-4] >= threshold:
-                arr.append((cell, D[cell], round(df.iloc[i, 1:].values[-4], 2)))
+def load_detail(detail):
+    """Load the general ledger detail export."""
+    return excel_io.read_excel(detail, skiprows=list(range(0,10)), usecols='F:Z', header=[1],
+                               converters={'Posting Date':pd.to_datetime, 'Acct #':str})
 
-    df2 = pd.read_excel(detail, skiprows=list(range(0,10)), usecols='F:Z', header=[1],
-                       converters={'Posting Date':pd.to_datetime, 'Acct #':str})
+def stream_detail(detail, start=None, end=None, accounts=None, chunksize=50000):
+    """
+    Read the general ledger detail export a chunk of rows at a time, keeping only the columns the notes use. Posting
+    dates are parsed a chunk at a time, and each chunk is cut down to entries posted from start to end on one of
+    accounts before the next is read, so memory holds one chunk plus the entries kept however long the ledger is.
+    Unlike load_detail it doesn't go through the workbook cache.
+    """
+    from openpyxl import load_workbook
+    book = load_workbook(detail, read_only=True, data_only=True)
+    try:
+        rows = book.worksheets[0].iter_rows(min_row=12, min_col=6, max_col=26, values_only=True)
+        header = list(next(rows))
+        positions = [header.index(column) for column in DETAIL_COLUMNS]
+        accounts = None if accounts is None else {str(acct) for acct in accounts}
+        chunks = []
+        while True:
+            chunk = [tuple(row[i] for i in positions) for row in islice(rows, chunksize)]
+            if not chunk:
+                break
+            df = pd.DataFrame(chunk, columns=DETAIL_COLUMNS)
+            df['Acct #'] = df['Acct #'].map(str)
+            df['Posting Date'] = pd.to_datetime(df['Posting Date'], errors='coerce')
+            keep = pd.Series(True, index=df.index)
+            if start is not None:
+                keep &= df['Posting Date'] >= start
+            if end is not None:
+                keep &= df['Posting Date'] <= end
+            if accounts is not None:
+                keep &= df['Acct #'].isin(accounts)
+            chunks.append(df[keep])
+    finally:
+        book.close()
+    if not chunks:
+        return pd.DataFrame(columns=DETAIL_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
 
-    df2 = df2[df2['Posting Date'] >= start]
-    L = []
+def variance_notes(arr, df2):
+    """
+    Explain each flagged line from the ledger entries in df2. Returns one record per line with the note to copy onto
+    the worksheet alongside the variance, the amount the entries explain and the entries themselves.
+    """
+    ledger = index_ledger(df2, arr)
+    records = []
     for i in range(len(arr)):
-        variance = 0
-        frame = df2[df2['Acct #'].isin(arr[i][1])].sort_values(by='Debit Amount', ascending=False)
-        amts = frame['Debit Amount'].tolist()
-        vendors = frame['Vendor Name'].tolist()
-        descriptions = frame['G/L Description'].tolist()
-        j = 0
-        vdict = {arr[i][0]: 'Paid '}
-        while variance < arr[i][-1]:
-            if not amts[j] == 0:
-                if str(vendors[j]) == 'nan':
-                    vdict[arr[i][0]] += '${} to {}, '.format(amts[j], descriptions[j].lower().title())
-                else:
-                    vdict[arr[i][0]] += '${} to {}, '.format(amts[j], vendors[j].lower().title())
-            variance += amts[j]
-            j += 1
-
-        for k, v in vdict.items():
-            s = '''{}) {}\n{}'''.format(str(i+1), arr[i][0], vdict[arr[i][0]].strip(', '))
-            yield s
+        frame = ledger.get(i, df2.iloc[:0])
+        entries, explained = explain(frame, arr[i][-1])
+        s = '''{}) {}\n{}'''.format(str(i+1), arr[i][0], ('Paid ' + describe(entries)).strip(', '))
+        if explained < arr[i][-1]:
+            s += '\nGL entries only explain ${} of ${}'.format(explained, arr[i][-1])
+        records.append({
+            'number': i + 1,
+            'line': arr[i][0],
+            'variance': arr[i][-1],
+            'explained': explained,
+            'note': s,
+            'entries': [{'amount': amt, 'vendor': None if pd.isna(vendor) else vendor, 'description': descr}
+                        for amt, vendor, descr in zip(entries['Debit Amount'].tolist(), entries['Vendor Name'].tolist(),
+                                                      entries['G/L Description'].tolist())],
+        })
+    return records
+
+def variance_records(start, statement='data/financial_statement.xlsx', detail='data/detail.xlsx', threshold=500,
+                     accounts='expense_accounts.pickle', chunksize=None):
+    """
+    Variance records for a single statement, explained from ledger entries posted on or after start. With a
+    chunksize the ledger is streamed, keeping only entries for the flagged lines' accounts.
+    """
+    arr = flagged_lines(statement, reference_data.load(accounts), threshold)
+    if chunksize:
+        df2 = stream_detail(detail, start=start, accounts=[acct for line in arr for acct in line[1]],
+                            chunksize=chunksize)
+    else:
+        df2 = load_detail(detail)
+        df2 = df2[df2['Posting Date'] >= start]
+    return variance_notes(arr, df2)
+
+def parse_variance(start, statement='data/financial_statement.xlsx', detail='data/detail.xlsx', threshold=500,
+                   accounts='expense_accounts.pickle', chunksize=None):
+    """
+    provide the start date, financial statement, and general ledger to scan the financial statement and examine 
+    expense differences above a desired threshold. If expenses are above the desired variance/threshold 
+    gather general ledger entries sorted by most expensive to least expensive. While the sum of these charges is
+    less than the amount of variance print statement notes to copy onto worksheet. Set chunksize to stream a
+    ledger too big to load whole.
+    """
+    for record in variance_records(start, statement, detail, threshold, accounts, chunksize):
+        yield record['note']
+
+def find_periods(dir):
+    """
+    Periods under a directory, one per subdirectory holding a financial_statement.xlsx. Each period uses the
+    detail.xlsx next to its statement, or the shared detail.xlsx at the top of the directory if it has none.
+    """
+    periods = []
+    for name in sorted(os.listdir(dir)):
+        statement = os.path.join(dir, name, 'financial_statement.xlsx')
+        if os.path.isfile(statement):
+            detail = os.path.join(dir, name, 'detail.xlsx')
+            periods.append((statement, detail if os.path.isfile(detail) else os.path.join(dir, 'detail.xlsx')))
+    return periods
+
+def batch_variance(periods, threshold=500, accounts='expense_accounts.pickle', chunksize=None):
+    """
+    Variance notes for several (statement, detail) periods, or a directory of them, in one pass. Each detail
+    workbook is loaded once and sorted by Posting Date, and every period's Start Date to End Date window is cut
+    from it with searchsorted. With a chunksize each workbook is streamed instead, keeping only expense account
+    entries. Returns one record per flagged line, tagged with its period.
+    """
+    if isinstance(periods, str):
+        periods = find_periods(periods)
+    D = reference_data.load(accounts)
+    ledgers = {}
+    records = []
+    for statement, detail in periods:
+        if detail not in ledgers:
+            if chunksize:
+                df2 = stream_detail(detail, accounts={acct for accts in D.values() for acct in accts},
+                                    chunksize=chunksize)
+            else:
+                df2 = load_detail(detail)
+            df2 = df2.dropna(subset=['Posting Date'])
+            ledgers[detail] = df2.sort_values('Posting Date', kind='mergesort')
+        df2 = ledgers[detail]
+        start, end = get_dates(statement)
+        dates = df2['Posting Date']
+        window = df2.iloc[dates.searchsorted(pd.Timestamp(start)):dates.searchsorted(pd.Timestamp(end), side='right')]
+        for record in variance_notes(flagged_lines(statement, D, threshold), window):
+            records.append(dict(record, statement=statement, start=start.strftime('%m/%d/%Y'),
+                                end=end.strftime('%m/%d/%Y')))
+    return records
+
+def write_notes(records, path):
+    """Write variance records as JSON, or as CSV with one row per line and without the entries."""
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(records, f, indent=2, default=str)
+    else:
+        columns = ['statement', 'start', 'end', 'number', 'line', 'variance', 'explained', 'note']
+        pd.DataFrame(records).reindex(columns=columns).to_csv(path, index=False)
 
 if __name__ == '__main__':
-    start, end = get_dates('data/financial_statement.xlsx')
-    for x in parse_variance(start=start):
-        print(x)
-        print()
+    import cli
+    import sys
+    sys.exit(cli.main(['variance'] + sys.argv[1:]))
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+enabled = False
+records = []
+_local = threading.local()
+
+def enable(memory=True):
+    """
+    Start recording stages. memory also tracks each stage's peak allocation with tracemalloc, which slows Python
+    allocation noticeably while it runs.
+    """
+    global enabled
+    enabled = True
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def count_rows(result, *args):
+    """
+    Rows a stage processed: the length of a DataFrame or list result, or of the first item of a tuple result,
+    falling back to the first DataFrame argument.
+    """
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    for value in (result,) + args:
+        if isinstance(value, list) or type(value).__name__ in ('DataFrame', 'Series'):
+            return len(value)
+    return None
+
+@contextmanager
+def stage(name):
+    """
+    Record wall time and peak traced memory for the enclosed block; set `rows` on the yielded record to note how many
+    rows it processed. Stages nest, and a stage's peak includes its children's. Nesting is tracked per thread, but
+    tracemalloc peaks are process wide, so stages running concurrently share them. Does nothing while disabled.
+    """
+    if not enabled:
+        yield {}
+        return
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _stack = _local.stack
+    record = {'stage': name, 'depth': len(_stack), 'rows': None}
+    memory = tracemalloc.is_tracing()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]['_peak'] = max(_stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_base'] = record['_peak'] = current
+    _stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        _stack.pop()
+        if memory and tracemalloc.is_tracing():
+            record['_peak'] = max(record['_peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = round((record['_peak'] - record['_base']) / 2 ** 20, 2)
+            if _stack:
+                _stack[-1]['_peak'] = max(_stack[-1]['_peak'], record['_peak'])
+        records.append({k: v for k, v in record.items() if not k.startswith('_')})
+
+def timed(name=None, rows=count_rows):
+    """
+    Decorator recording every call of a function as a stage named after it. rows is called with the result and the
+    arguments to count the rows processed. While instrumentation is disabled the only overhead is one flag check
+    per call. Stages run inside process pool workers are not recorded, so use workers=1 for a full breakdown.
+    """
+    def decorate(func):
+        label = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with stage(label) as record:
+                result = func(*args, **kwargs)
+                record['rows'] = rows(result, *args)
+            return result
+        return wrapper
+    return decorate
+
+def summary():
+    """Recorded stages as a table, in the order they finished."""
+    lines = ['{:<32} {:>10} {:>10} {:>10}'.format('stage', 'seconds', 'rows', 'peak MB')]
+    for record in records:
+        lines.append('{:<32} {:>10} {:>10} {:>10}'.format(
+            '  ' * record['depth'] + record['stage'], record['seconds'],
+            '' if record['rows'] is None else record['rows'], record.get('peak_mb', '')))
+    return '\n'.join(lines)
+
+def write_trace(path):
+    """Write the recorded stages to a JSON trace file."""
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=2)
+
+def report(trace=None):
+    """Print the summary table, and write the JSON trace too when given a path."""
+    if records:
+        print(summary())
+        if trace:
+            write_trace(trace)
+
+if os.environ.get('JOURNAL_TRACE'):
+    enable(memory=os.environ.get('JOURNAL_TRACE_MEMORY', '1') != '0')
+    atexit.register(report, None if os.environ['JOURNAL_TRACE'] == '1' else os.environ['JOURNAL_TRACE'])
@@ -0,0 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+
+def pmap(func, *iterables, workers=None):
+    """
+    Map func over the iterables in a process pool and return the results in input order. workers defaults to the
+    number of CPUs; workers=1 runs everything in this process, skipping the pool start-up cost. When other threads
+    are running, such as concurrent close stages, workers come from a forkserver rather than a plain fork, which can
+    deadlock on a lock another thread held at the time.
+    """
+    if workers == 1:
+        return list(map(func, *iterables))
+    context = multiprocessing.get_context('forkserver') if threading.active_count() > 1 else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(func, *iterables))
@@ -1,71 +1,118 @@
-from PyPDF2 import PdfFileMerger, PdfFileReader
-import PyPDF2
+import hashlib
+import instrument
+import json
 import os
+import parallel
 
-def merge_td(dir):
+MANIFEST = '.manifest.json'
+
+def pair_key(file, tag=None):
+    """Key used to match a pdf with its partner: the filename stem less its tag, '146 FEES.pdf' -> '146'."""
+    stem = os.path.splitext(file)[0]
+    if tag and stem.endswith(tag):
+        stem = stem[:-len(tag)]
+    return stem.strip(' -_')
+
+def pair_files(files, first_tag, second_tag):
     """
-    scan a folder of pdf files combining the cover page of bank statements with pdf documents provided by coworker.
+    Pair the pdfs ending in first_tag with the pdfs ending in second_tag by pair_key. A first_tag of None takes every
+    pdf not ending in second_tag. Returns the (first, second) pairs in key order and every file without a partner,
+    including files that share a key with another file on the same side.
     """
+    firsts, seconds, unmatched = {}, {}, []
+    for file in sorted(files):
+        stem = os.path.splitext(file)[0]
+        if not file.lower().endswith('.pdf'):
+            continue
+        if stem.endswith(second_tag):
+            side, key = seconds, pair_key(file, second_tag)
+        elif first_tag is None or stem.endswith(first_tag):
+            side, key = firsts, pair_key(file, first_tag)
+        else:
+            continue
+        if key in side:
+            unmatched.append(file)
+        else:
+            side[key] = file
+    pairs = [(firsts[key], seconds[key]) for key in sorted(firsts.keys() & seconds.keys())]
+    unmatched += [firsts[key] for key in firsts.keys() - seconds.keys()]
+    unmatched += [seconds[key] for key in seconds.keys() - firsts.keys()]
+    return pairs, sorted(unmatched)
+
+def merge_pair(first, second, output):
+    """Write first followed by second to output, appending each as a whole document."""
+    from PyPDF2 import PdfFileMerger
     merger = PdfFileMerger()
-    if not len(os.listdir(dir)) % 2 == 0:
-        print('unequal lengths')
-        return None
-
-    beg = sorted([file for file in os.listdir(dir) if file.endswith('XFER.pdf')])
-    end = sorted([file for file in os.listdir(dir) if file.endswith('FEES.pdf')])
-
-    for i, file in enumerate(beg):
-        pdf1 = open(dir + '/' + file, 'rb')
-        pdf2 = open(dir + '/' + end[i], 'rb')
-
-        pdf1Reader = PdfFileReader(pdf1)
-        pdf2Reader = PdfFileReader(pdf2)
-
-        pdfWriter = PyPDF2.PdfFileWriter()
-
-        for pageNum in range(pdf1Reader.numPages):
-            pageObj = pdf1Reader.getPage(pageNum)
-            pdfWriter.addPage(pageObj)
-
-        for pageNum in range(pdf2Reader.numPages):
-            pageObj = pdf2Reader.getPage(pageNum)
-            pdfWriter.addPage(pageObj)
-
-        pdfOutputFile = open('fees/{}'.format(end[i]), 'wb')
-        pdfWriter.write(pdfOutputFile)
-
-        pdfOutputFile.close()
-        pdf1.close()
-        pdf2.close()
+    try:
+        merger.append(first)
+        merger.append(second)
+        merger.write(output)
+    finally:
+        merger.close()
+    return output
+
+def fingerprint(path, previous=None):
+    """Size, mtime and sha256 of a file. The previous hash is reused when the size and mtime haven't changed."""
+    stat = os.stat(path)
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+
+def load_manifest(out_dir):
+    """Inputs each output in out_dir was last merged from, keyed by output filename."""
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def merge_dir(dir, out_dir, first_tag, second_tag, named_after='second', workers=None, incremental=False):
+    """
+    Pair the pdfs in dir and merge every pair into out_dir in a pool of `workers` processes, naming each output after
+    the first or second file of its pair. Files without a partner are reported and skipped. The content hash of
+    each pair's inputs is recorded in a manifest in out_dir; with incremental set, pairs whose inputs hash the same
+    as last time and whose output still exists are skipped. Returns the merged outputs and the unmatched files.
+    """
+    pairs, unmatched = pair_files(os.listdir(dir), first_tag, second_tag)
+    for file in unmatched:
+        print('{} has no matching pdf, skipped'.format(file))
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    todo = []
+    for first, second in pairs:
+        name = first if named_after == 'first' else second
+        entry = manifest.get(name, {'inputs': [], 'fingerprints': []})
+        previous = entry['fingerprints'] if entry['inputs'] == [first, second] else [None, None]
+        fingerprints = [fingerprint(os.path.join(dir, first), previous[0]),
+                        fingerprint(os.path.join(dir, second), previous[1])]
+        unchanged = previous[0] is not None and [x['sha256'] for x in fingerprints] == [x['sha256'] for x in previous]
+        if not (incremental and unchanged and os.path.exists(os.path.join(out_dir, name))):
+            todo.append((os.path.join(dir, first), os.path.join(dir, second), os.path.join(out_dir, name)))
+        manifest[name] = {'inputs': [first, second], 'fingerprints': fingerprints}
+
+    outputs = parallel.pmap(merge_pair, *zip(*todo), workers=workers) if todo else []
+    save_manifest(out_dir, manifest)
+    return outputs, unmatched
+
+@instrument.timed()
+def merge_td(dir, workers=None, incremental=False):
+    """
+    scan a folder of pdf files combining the cover page of bank statements with pdf documents provided by coworker.
+    """
+    return merge_dir(dir, 'fees', 'XFER', 'FEES', named_after='second', workers=workers, incremental=incremental)
 
-def merge_crystal(dir):
+@instrument.timed()
+def merge_crystal(dir, workers=None, incremental=False):
     """
     Merge pdf documents for accounts receivable posting backup.
     """
-    merger = PdfFileMerger()
-    beg = sorted([file for file in os.listdir(dir) if not file.endswith('FEES.pdf')])
-    end = sorted([file for file in os.listdir(dir) if file.endswith('FEES.pdf')])
-
-    for i, file in enumerate(beg):
-        pdf1 = open(dir + '/' + file, 'rb')
-        pdf2 = open(dir + '/' + end[i], 'rb')
-
-        pdf1Reader = PdfFileReader(pdf1)
-        pdf2Reader = PdfFileReader(pdf2)
-
-        pdfWriter = PyPDF2.PdfFileWriter()
-
-        for pageNum in range(pdf1Reader.numPages):
-            pageObj = pdf1Reader.getPage(pageNum)
-            pdfWriter.addPage(pageObj)
-
-        for pageNum in range(pdf2Reader.numPages):
-            pageObj = pdf2Reader.getPage(pageNum)
-            pdfWriter.addPage(pageObj)
-
-        pdfOutputFile = open('final/{}'.format(beg[i]), 'wb')
-        pdfWriter.write(pdfOutputFile)
-
-        pdfOutputFile.close()
-        pdf1.close()
-        pdf2.close()
+    return merge_dir(dir, 'final', None, 'FEES', named_after='first', workers=workers, incremental=incremental)
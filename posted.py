@@ -0,0 +1,55 @@
+import datetime
+import pandas as pd
+import sqlite3
+
+STORE = 'data/posted.sqlite'
+KEY = ['file_number', 'acct_code', 'payment_date', 'cents', 'seq']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posted (
+    file_number TEXT NOT NULL,
+    acct_code TEXT NOT NULL,
+    payment_date TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    journal TEXT,
+    posted_at TEXT,
+    PRIMARY KEY (file_number, acct_code, payment_date, cents, seq)
+);
+CREATE INDEX IF NOT EXISTS posted_date ON posted (payment_date);
+"""
+
+def connect(path=STORE):
+    """Open the posted lines store, creating it on first use."""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def line_keys(df):
+    """
+    Key of every cleaned cash line: File Number, AcctCode, PaymentDate as YYYY-MM-DD, the amount in cents and seq,
+    which counts identical lines within the export so that a line repeated in a re-pulled export keeps its key.
+    """
+    keys = pd.DataFrame({
+        'file_number': df['File Number'].astype(str),
+        'acct_code': df['AcctCode'].astype(str),
+        'payment_date': pd.to_datetime(df['PaymentDate']).dt.strftime('%Y-%m-%d'),
+        'cents': (df['Invoice Line Total'] * 100).round().astype('int64'),
+    }, index=df.index)
+    keys['seq'] = keys.groupby(KEY[:-1], sort=False).cumcount()
+    return keys
+
+def unseen(conn, keys):
+    """Mask of the keys not yet in the store, looked up by the payment dates they fall on."""
+    dates = keys.payment_date.unique().tolist()
+    seen = conn.execute('SELECT {} FROM posted WHERE payment_date IN ({})'.format(
+        ', '.join(KEY), ', '.join('?' * len(dates))), dates).fetchall()
+    return pd.Series(~pd.MultiIndex.from_frame(keys[KEY]).isin(seen), index=keys.index)
+
+def record(conn, keys, journal):
+    """Store keys as posted to the journal workbook, in one transaction."""
+    posted_at = datetime.datetime.now().isoformat(timespec='seconds')
+    rows = [row + (journal, posted_at) for row in keys[KEY].itertuples(index=False, name=None)]
+    with conn:
+        conn.executemany('INSERT INTO posted ({}, journal, posted_at) VALUES ({})'.format(
+            ', '.join(KEY), ', '.join('?' * (len(KEY) + 2))), rows)
@@ -0,0 +1,45 @@
+import os
+import pickle
+import pandas as pd
+
+DATABASES = '/data/workspace_files/databases/'
+
+_cache = {}
+
+def load(path, transform=None):
+    """
+    Load a reference pickle once per process. Entries are keyed by the absolute path and the optional transform
+    applied to the raw object, and are reloaded whenever the file's mtime changes. Callers share the returned
+    object, so treat it as read-only.
+    """
+    key = (os.path.abspath(path), transform)
+    mtime = os.stat(path).st_mtime_ns
+    if key in _cache and _cache[key][0] == mtime:
+        return _cache[key][1]
+    if transform is None:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    else:
+        value = transform(load(path))
+    _cache[key] = (mtime, value)
+    return value
+
+def clear():
+    """Drop every cached table, forcing the next load to read from disk."""
+    _cache.clear()
+
+def employee_table(employee):
+    """Employee dict keyed by the last 4 digits of the card number as a DataFrame indexed by card suffix."""
+    table = pd.DataFrame.from_dict(employee, orient='index')
+    return table.reindex(columns=['state', 'branch', 'dept', 'ic_code'])
+
+def keyword_index(keywords):
+    """
+    Invert the keyword lists into a single word -> account lookup. A word listed under several accounts maps to
+    the last one, the same account the category-by-category scan would have settled on.
+    """
+    index = {}
+    for acct, words in keywords.items():
+        for word in words:
+            index[word] = acct
+    return index
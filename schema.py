@@ -0,0 +1,38 @@
+CODE = 'category'
+AMOUNT = 'Float64'
+
+CASH_JOURNAL = {
+    'Date': CODE,
+    'Type': CODE,
+    'Account': CODE,
+    'St': CODE,
+    'Branch': CODE,
+    'Dept': CODE,
+    'Description Reference': CODE,
+    'Debits': AMOUNT,
+    'Credits': AMOUNT,
+}
+
+TD_JOURNAL = {
+    'Type': CODE,
+    'No': CODE,
+    'State': CODE,
+    'Branch Code': CODE,
+    'Dept Code': CODE,
+    'Quantity': 'int8',
+    'Direct Unit Cost': AMOUNT,
+    'IC Partner Ref Type': CODE,
+    'IC Partner Code': CODE,
+    'IC Partner Reference': CODE,
+}
+
+def apply(df, schema):
+    """
+    Cast the columns of df named in schema. Code columns become categoricals, amounts nullable floats that keep
+    missing values as NA, and columns missing from the schema, like free text descriptions, are left alone.
+    """
+    return df.astype({column: dtype for column, dtype in schema.items() if column in df.columns})
+
+def codes_as_objects(df, schema):
+    """Plain object copies of the categorical columns, for setting values that aren't among their categories yet."""
+    return df.astype({column: object for column, dtype in schema.items() if dtype == CODE and column in df.columns})
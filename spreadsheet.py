@@ -0,0 +1,56 @@
+import pandas as pd
+
+class Workbook:
+    """
+    xlsxwriter workbook in constant_memory mode. Sheets are streamed to disk row by row as they are added, and
+    formats are created once per distinct set of properties and reused across sheets.
+    """
+    def __init__(self, filename):
+        import xlsxwriter
+        self.filename = filename
+        self.book = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        self._formats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.book.close()
+
+    def format(self, properties):
+        """Return the workbook format for a dict of properties, creating it the first time it's asked for."""
+        key = tuple(sorted(properties.items()))
+        if key not in self._formats:
+            self._formats[key] = self.book.add_format(properties)
+        return self._formats[key]
+
+    def add_sheet(self, name, df, columns=(), formulas=()):
+        """
+        Write df to a new sheet under a plain header row, as DataFrame.to_excel does, leaving missing values blank.
+        columns holds (first, last, width) or (first, last, width, format properties) tuples for set_column.
+        formulas holds (cell, formula) pairs such as ('J12', '=SUM(I3:I11)'). Rows can't be revisited in
+        constant_memory mode, so each formula is written as soon as its row has been.
+        """
+        from xlsxwriter.utility import xl_cell_to_rowcol
+        sheet = self.book.add_worksheet(name)
+        for first, last, width, *properties in columns:
+            sheet.set_column(first, last, width, self.format(properties[0]) if properties else None)
+
+        for col, title in enumerate(df.columns):
+            sheet.write(0, col, title)
+
+        pending = sorted((xl_cell_to_rowcol(cell), formula) for cell, formula in formulas)
+        values = [df[column].tolist() for column in df.columns]
+        for row, cells in enumerate(zip(*values), start=1):
+            for col, value in enumerate(cells):
+                if not pd.isna(value):
+                    sheet.write(row, col, value)
+            while pending and pending[0][0][0] <= row:
+                (r, c), formula = pending.pop(0)
+                sheet.write_formula(r, c, formula)
+        for (r, c), formula in pending:
+            sheet.write_formula(r, c, formula)
+        return sheet
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+import cash
+
+CTX = cash.Context(branches={'21': '001'},
+                   closing={1: {'revenue': '40000', 'count': '99001'}},
+                   accounts={146: {'bank': '10100', 'sheet': 'S146'}})
+
+def write_export(path, amount, date):
+    pd.DataFrame({
+        'File Number': ['21-1-NJ1'],
+        'TitleCoNum': ['21'],
+        'AcctCode': ['40000'],
+        'OrderCategory': [1],
+        'SortField': [1],
+        'Invoice Line Total': [amount],
+        'PaymentDate': [pd.Timestamp(date)],
+        'EscrowBank': [146],
+        'CloseAgent': ['AB'],
+    }).to_excel(path, index=False)
+
+def write_fees(amount):
+    pd.DataFrame({'File': ['21-1-NJ1'], 'Amount': [amount]}).to_excel('sheets/fee_master.xlsx', index=False)
+
+def test_consecutive_exports_with_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('sheets')
+    store = str(tmp_path / 'posted.sqlite')
+
+    write_export('sheets/a.xlsx', 100.0, '2021-03-01')
+    write_fees(100.0)
+    assert cash.check_sheet('sheets/a.xlsx') == ([], [])
+    cash.generate_journal('sheets/a.xlsx', ctx=CTX, workers=1, store=store)
+    assert os.listdir('cash_receipts') == ['03_01_2021 cash_receipts.xlsx']
+
+    write_export('sheets/b.xlsx', 50.0, '2021-03-02')
+    write_fees(50.0)
+    assert cash.check_sheet('sheets/b.xlsx') == ([], [])
+    cash.generate_journal('sheets/b.xlsx', ctx=CTX, workers=1, store=store)
+    assert sorted(os.listdir('cash_receipts')) == ['03_01_2021 cash_receipts.xlsx', '03_02_2021 cash_receipts.xlsx']
+
+    cash.generate_journal('sheets/b.xlsx', ctx=CTX, workers=1, store=store)
+    assert len(os.listdir('cash_receipts')) == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import financial_statement_analyzer as fsa
+
+def ledger(accts, amounts, vendors=None):
+    return pd.DataFrame({
+        'Acct #': accts,
+        'Posting Date': pd.Timestamp('2021-03-01'),
+        'Debit Amount': amounts,
+        'Vendor Name': vendors if vendors is not None else np.nan,
+        'G/L Description': 'OFFICE SUPPLIES',
+    })
+
+def test_line_without_entries_and_blank_vendors():
+    df2 = ledger(['1', '2'], [50.0, 80.0])
+    assert df2['Vendor Name'].dtype == np.float64
+    record, = fsa.variance_notes([('L1', ['3'], 120.0)], df2)
+    assert record['explained'] == 0
+    assert record['entries'] == []
+    assert record['note'] == '1) L1\nPaid\nGL entries only explain $0 of $120.0'
+
+def test_line_the_ledger_does_not_cover():
+    df2 = ledger(['1', '1', '2'], [50.0, 30.0, 80.0])
+    record, = fsa.variance_notes([('L1', ['1'], 120.0)], df2)
+    assert record['explained'] == 80.0
+    assert record['note'] == ('1) L1\nPaid $50.0 to Office Supplies, $30.0 to Office Supplies\n'
+                              'GL entries only explain $80.0 of $120.0')
+
+def test_line_the_ledger_covers():
+    df2 = ledger(['1', '1', '1'], [50.0, 90.0, 30.0], ['ACME CORP', np.nan, 'WIDGETS LLC'])
+    record, = fsa.variance_notes([('L1', ['1'], 120.0)], df2)
+    assert record['explained'] == 140.0
+    assert record['note'] == '1) L1\nPaid $90.0 to Office Supplies, $50.0 to Acme Corp'